@@ -14,23 +14,43 @@ class PipelineConfig:
     # Queue settings
     queue_max_size: int
     queue_timeout: float
+    batch_size: int  # Max items per queue transfer
+    batch_max_wait: float  # Max seconds a partial batch waits before being sent
 
     # Detection settings
     detection_threshold: float
     min_motion_area: int
     gaussian_blur_size: int
+    tile_gating: bool  # Only run full detection on tiles that changed
+    tile_size: int
+    tile_change_threshold: float  # Min sub-tile mean intensity change to wake a tile (0-255)
+    tile_static_frames: int  # Quiet frames before a tile is considered static
+    exclusion_mask: str  # Image whose non-zero pixels are ignored ("" = none)
 
     # Viewport settings
     viewport_width: int
     viewport_height: int
     smoothing_window_size: int
     smoothing_alpha: float  # For exponential moving average
+    viewport_mode: str  # "online" (causal, per frame) or "offline" (whole trajectory)
+    offline_smoothing_sigma: float  # Gaussian sigma in frames
+    offline_lookahead: int  # Frames the camera leads the action by
+    offline_max_velocity: float  # Pixels per frame
+    offline_max_acceleration: float  # Pixels per frame^2
 
     # Processing settings
     target_fps: int
     frame_resize_width: int
     frame_resize_height: int
 
+    # Supervisor settings
+    supervisor_poll_interval: float
+    supervisor_stall_timeout: float  # Seconds without progress before teardown
+    supervisor_shutdown_grace: float
+    supervisor_restart_crashed: bool  # Restart crashed stateless stages
+    supervisor_max_restarts: int
+    supervisor_allow_frame_loss: bool  # Exit 0 instead of FRAME_LOSS_EXIT_CODE when restarts dropped frames
+
     @classmethod
     def from_file(cls, config_path: str) -> "PipelineConfig":
         """
@@ -47,16 +67,34 @@ class PipelineConfig:
         return cls(
             queue_max_size=config.getint("queues","max_size",fallback=100),
             queue_timeout=config.getfloat("queues","timeout",fallback=5.0),
+            batch_size=config.getint("queues","batch_size",fallback=8),
+            batch_max_wait=config.getfloat("queues","batch_max_wait",fallback=0.1),
             detection_threshold=config.getfloat("detection","threshold",fallback=25.0),
             min_motion_area=config.getint("detection","min_motion_area",fallback=100),
             gaussian_blur_size=config.getint("detection","gaussian_blur_size",fallback=5),
+            tile_gating=config.getboolean("detection","tile_gating",fallback=False),
+            tile_size=config.getint("detection","tile_size",fallback=64),
+            tile_change_threshold=config.getfloat("detection","tile_change_threshold",fallback=4.0),
+            tile_static_frames=config.getint("detection","tile_static_frames",fallback=10),
+            exclusion_mask=config.get("detection","exclusion_mask",fallback=""),
             viewport_width=config.getint("viewport","width",fallback=720),
             viewport_height=config.getint("viewport","height",fallback=480),
             smoothing_window_size=config.getint("viewport","smoothing_window_size",fallback=5),
             smoothing_alpha=config.getfloat("viewport","smoothing_alpha",fallback=0.3),
+            viewport_mode=config.get("viewport","mode",fallback="online"),
+            offline_smoothing_sigma=config.getfloat("viewport","offline_smoothing_sigma",fallback=2.0),
+            offline_lookahead=config.getint("viewport","offline_lookahead",fallback=2),
+            offline_max_velocity=config.getfloat("viewport","offline_max_velocity",fallback=80.0),
+            offline_max_acceleration=config.getfloat("viewport","offline_max_acceleration",fallback=20.0),
             target_fps=config.getint("processing","target_fps",fallback=5),
             frame_resize_width=config.getint("processing","frame_resize_width",fallback=1280),
             frame_resize_height=config.getint("processing","frame_resize_height",fallback=720),
+            supervisor_poll_interval=config.getfloat("supervisor","poll_interval",fallback=0.5),
+            supervisor_stall_timeout=config.getfloat("supervisor","stall_timeout",fallback=30.0),
+            supervisor_shutdown_grace=config.getfloat("supervisor","shutdown_grace",fallback=3.0),
+            supervisor_restart_crashed=config.getboolean("supervisor","restart_crashed",fallback=False),
+            supervisor_max_restarts=config.getint("supervisor","max_restarts",fallback=3),
+            supervisor_allow_frame_loss=config.getboolean("supervisor","allow_frame_loss",fallback=False),
         )
     
     @classmethod
@@ -66,17 +104,35 @@ class PipelineConfig:
         return cls(
             queue_max_size=100,
             queue_timeout=5.0,
+            batch_size=8,
+            batch_max_wait=0.1,
             detection_threshold=25.0,
             min_motion_area=100,
             gaussian_blur_size=5,
+            tile_gating=False,
+            tile_size=64,
+            tile_change_threshold=4.0,
+            tile_static_frames=10,
+            exclusion_mask="",
             viewport_width=720,
             viewport_height=480,
             smoothing_window_size=5,
             smoothing_alpha=0.3,
+            viewport_mode="online",
+            offline_smoothing_sigma=2.0,
+            offline_lookahead=2,
+            offline_max_velocity=80.0,
+            offline_max_acceleration=20.0,
             target_fps=5,
             frame_resize_width=1280,
             frame_resize_height=720,
+            supervisor_poll_interval=0.5,
+            supervisor_stall_timeout=30.0,
+            supervisor_shutdown_grace=3.0,
+            supervisor_restart_crashed=False,
+            supervisor_max_restarts=3,
+            supervisor_allow_frame_loss=False,
         )
 
     def __str__(self):
-        return f"PipelineConfig(queue_size={self.queue_max_size}, viewport={self.viewport_width}x{self.viewport_height})"
+        return f"PipelineConfig(queue_size={self.queue_max_size}, batch_size={self.batch_size}, viewport={self.viewport_width}x{self.viewport_height})"
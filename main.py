@@ -1,16 +1,179 @@
 import os
+import sys
+import time
 import argparse
 import multiprocessing
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Callable, Optional
 import configparser
 
 from pipeline.frame_reader import FrameReaderProcess
-from pipeline.detector import DetectionProcess
-from pipeline.viewport_calculator import ViewportCalculatorProcess
+from pipeline.detector import DetectionProcess, validate_detection_config
+from pipeline.viewport_calculator import ViewportCalculatorProcess, OfflineViewportCalculatorProcess
 from pipeline.output_writer import OutputWriterProcess
-from pipeline.queue_manager import QueueManager
+from pipeline.queue_manager import QueueManager, StageHeartbeat
 from config import PipelineConfig
 
+# Exit status for a run that finished but lost frames to stage restarts
+FRAME_LOSS_EXIT_CODE = 3
+
+
+@dataclass
+class Stage:
+    """A supervised pipeline stage."""
+
+    name: str
+    factory: Callable[[StageHeartbeat], multiprocessing.Process]
+    heartbeat: StageHeartbeat
+    restartable: bool = False
+    process: Optional[multiprocessing.Process] = None
+    restarts: int = 0
+
+
+class PipelineSupervisor:
+    """
+    Starts the pipeline stages and watches them until they finish.
+
+    The pipeline fails fast when a stage crashes or when no stage has made
+    progress for `supervisor_stall_timeout` seconds (e.g. an upstream stage was
+    killed before its sentinel got through and downstream stages keep waiting).
+    """
+
+    def __init__(self, config: PipelineConfig):
+        self.config = config
+        self.stages = []
+
+    def add_stage(self, name, factory, restartable=False):
+        """Register a stage. `factory(heartbeat)` must return a new, unstarted process."""
+        self.stages.append(
+            Stage(name=name, factory=factory, heartbeat=StageHeartbeat(), restartable=restartable)
+        )
+
+    def _start(self, stage):
+        stage.process = stage.factory(stage.heartbeat)
+        stage.process.start()
+        print(f"Started process: {stage.name} (pid={stage.process.pid})")
+
+    def _try_restart(self, stage):
+        """
+        Restart a stage that crashed with a Python exception.
+        Stages killed by a signal (negative exit code, e.g. OOM kill) may have died
+        holding a queue lock, so they are never restarted.
+        """
+        if not (self.config.supervisor_restart_crashed and stage.restartable):
+            return False
+        if stage.process.exitcode < 0 or stage.restarts >= self.config.supervisor_max_restarts:
+            return False
+        stage.restarts += 1
+        print(
+            f"Supervisor: {stage.name} exited with code {stage.process.exitcode}, "
+            f"restarting ({stage.restarts}/{self.config.supervisor_max_restarts})"
+        )
+        self._start(stage)
+        return True
+
+    def _check(self, start_time):
+        """
+        Check stage liveness.
+        Returns (finished, failure_reason)
+        """
+        for stage in self.stages:
+            exitcode = stage.process.exitcode
+            if exitcode is None or exitcode == 0:
+                continue
+            if self._try_restart(stage):
+                continue
+            return False, f"{stage.name} exited with code {exitcode}"
+
+        if all(stage.process.exitcode == 0 for stage in self.stages):
+            return True, None
+
+        last_progress = max([start_time] + [stage.heartbeat.last_beat.value for stage in self.stages])
+        idle = time.time() - last_progress
+        if idle > self.config.supervisor_stall_timeout:
+            return False, f"no stage made progress for {idle:.1f}s"
+        return False, None
+
+    def _check_frames_lost(self):
+        """
+        Compare items produced by the first stage with items consumed by the last.
+        A restarted stage takes its in-flight input with it, so a finished run can
+        still be missing frames.
+        Returns the process exit status (0 if nothing was lost or loss is allowed)
+        """
+        produced = self.stages[0].heartbeat.items_processed.value
+        written = self.stages[-1].heartbeat.items_processed.value
+        lost = produced - written
+        if lost <= 0:
+            return 0
+        restarts = ", ".join(f"{stage.name} x{stage.restarts}" for stage in self.stages if stage.restarts)
+        print(
+            f"Pipeline WARNING: {lost} of {produced} frames lost "
+            f"(restarts: {restarts or 'none'})"
+        )
+        if self.config.supervisor_allow_frame_loss:
+            return 0
+        return FRAME_LOSS_EXIT_CODE
+
+    def teardown(self):
+        """Terminate all live stages, escalating to kill after the grace period."""
+        alive = [stage.process for stage in self.stages if stage.process is not None and stage.process.is_alive()]
+        for process in alive:
+            process.terminate()
+        deadline = time.time() + self.config.supervisor_shutdown_grace
+        for process in alive:
+            process.join(timeout=max(0.0, deadline - time.time()))
+        for process in alive:
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+    def report(self, reason):
+        """Print a per-stage summary of the failed run."""
+        print(f"Pipeline FAILED: {reason}")
+        now = time.time()
+        for stage in self.stages:
+            last_beat = stage.heartbeat.last_beat.value
+            last_seen = f"{now - last_beat:.1f}s ago" if last_beat else "never"
+            print(
+                f"  {stage.name:<20} exitcode={stage.process.exitcode} "
+                f"items={stage.heartbeat.items_processed.value} "
+                f"restarts={stage.restarts} last_progress={last_seen}"
+            )
+
+    def run(self):
+        """
+        Run the pipeline to completion.
+        Returns the process exit status (0 on success)
+        """
+        start_time = time.time()
+        try:
+            for stage in self.stages:
+                self._start(stage)
+
+            while True:
+                finished, failure = self._check(start_time)
+                if finished:
+                    for stage in self.stages:
+                        stage.process.join()
+                        print(f"Completed process: {stage.name}")
+                    return self._check_frames_lost()
+                if failure is not None:
+                    self.teardown()
+                    self.report(failure)
+                    return 1
+                time.sleep(self.config.supervisor_poll_interval)
+
+        except KeyboardInterrupt:
+            print("\nShutting down pipeline...")
+            self.teardown()
+            return 130
+        except Exception as e:
+            print(f"Error in pipeline: {e}")
+            self.teardown()
+            raise
+
 
 def parse_args():
     """Parse command line arguments."""
@@ -43,69 +206,81 @@ def main():
     print(f"Starting viewport tracking pipeline for: {args.video}")
     print(f"Configuration: {config}")
 
+    # Online mode smooths causally per frame; offline solves the whole path after the last detection
+    viewport_classes = {
+        "online": ViewportCalculatorProcess,
+        "offline": OfflineViewportCalculatorProcess,
+    }
+    if config.viewport_mode not in viewport_classes:
+        print(f"Unknown viewport mode '{config.viewport_mode}', expected one of {list(viewport_classes)}")
+        return 2
+    viewport_class = viewport_classes[config.viewport_mode]
+
+    # Fail before any stage starts rather than restarting detection on a config error
+    try:
+        validate_detection_config(config)
+    except (ValueError, FileNotFoundError) as e:
+        print(f"Invalid detection configuration: {e}")
+        return 2
+
     # Initialize queue manager
     queue_manager = QueueManager(config)
 
-    # Create processes
-    processes = []
+    # Register pipeline stages with the supervisor
+    supervisor = PipelineSupervisor(config)
 
     # Frame Reader Process
-    frame_reader = FrameReaderProcess(
-        input_video=args.video,
-        output_queue=queue_manager.raw_frames_queue,
-        config=config,
+    supervisor.add_stage(
+        "FrameReader",
+        lambda heartbeat: FrameReaderProcess(
+            input_video=args.video,
+            output_queue=queue_manager.raw_frames_queue,
+            config=config,
+            heartbeat=heartbeat,
+        ),
     )
-    processes.append(frame_reader)
 
-    # Detection Process
-    detector = DetectionProcess(
-        input_queue=queue_manager.raw_frames_queue,
-        output_queue=queue_manager.detections_queue,
-        config=config,
+    # Detection Process (only keeps the previous frame, so safe to restart)
+    supervisor.add_stage(
+        "Detection",
+        lambda heartbeat: DetectionProcess(
+            input_queue=queue_manager.raw_frames_queue,
+            output_queue=queue_manager.detections_queue,
+            config=config,
+            heartbeat=heartbeat,
+        ),
+        restartable=True,
     )
-    processes.append(detector)
 
     # Viewport Calculator Process
-    viewport_calculator = ViewportCalculatorProcess(
-        input_queue=queue_manager.detections_queue,
-        output_queue=queue_manager.viewport_queue,
-        config=config,
+    supervisor.add_stage(
+        "ViewportCalculator",
+        lambda heartbeat: viewport_class(
+            input_queue=queue_manager.detections_queue,
+            output_queue=queue_manager.viewport_queue,
+            config=config,
+            heartbeat=heartbeat,
+        ),
     )
-    processes.append(viewport_calculator)
 
     # Output Writer Process
-    output_writer = OutputWriterProcess(
-        input_queue=queue_manager.viewport_queue,
-        output_dir=args.output,
-        config=config,
+    supervisor.add_stage(
+        "OutputWriter",
+        lambda heartbeat: OutputWriterProcess(
+            input_queue=queue_manager.viewport_queue,
+            output_dir=args.output,
+            config=config,
+            heartbeat=heartbeat,
+        ),
     )
-    processes.append(output_writer)
 
-    # Start all processes
-    try:
-        for process in processes:
-            process.start()
-            print(f"Started process: {process.__class__.__name__}")
-
-        # Wait for all processes to complete
-        for process in processes:
-            process.join()
-            print(f"Completed process: {process.__class__.__name__}")
-
-    except KeyboardInterrupt:
-        print("\nShutting down pipeline...")
-        for process in processes:
-            process.terminate()
-            process.join()
-    except Exception as e:
-        print(f"Error in pipeline: {e}")
-        for process in processes:
-            process.terminate()
-            process.join()
-        raise
+    exit_code = supervisor.run()
+    if exit_code != 0:
+        return exit_code
 
     print(f"Pipeline complete. Results saved to {args.output}")
+    return 0
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
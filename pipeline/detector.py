@@ -6,12 +6,144 @@ import cv2
 import numpy as np
 from multiprocessing import Process
 from typing import Optional
-from queue import Empty,Full
+from queue import Empty
 
-from pipeline.queue_manager import FrameData, DetectionData
+from pipeline.queue_manager import FrameData, DetectionData, StageHeartbeat, BatchSender, receive_timeout
 from config import PipelineConfig
 
 
+# Sub-cells per tile side used for the cheap change statistic
+TILE_SUBDIVISIONS = 4
+
+
+def load_exclusion_mask(path, frame_shape):
+    """
+    Load a user-supplied exclusion mask and scale it to the frame size.
+    Returns boolean array, True where pixels should be ignored
+    """
+    mask = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if mask is None:
+        raise FileNotFoundError(f"Could not read exclusion mask: {path}")
+    h, w = frame_shape[:2]
+    mask = cv2.resize(mask, (w, h), interpolation=cv2.INTER_NEAREST)
+    return mask > 0
+
+
+def check_tile_size(tile_size):
+    """Tiles are split into whole-pixel sub-cells, so the size must divide evenly."""
+    if tile_size < TILE_SUBDIVISIONS or tile_size % TILE_SUBDIVISIONS:
+        raise ValueError(f"tile_size must be a positive multiple of {TILE_SUBDIVISIONS}, got {tile_size}")
+
+
+def validate_detection_config(config: PipelineConfig):
+    """
+    Check detection settings that would otherwise only fail inside the
+    detection process on its first frame.
+    Raises ValueError or FileNotFoundError
+    """
+    if config.tile_gating:
+        check_tile_size(config.tile_size)
+    if config.exclusion_mask:
+        load_exclusion_mask(config.exclusion_mask, (config.frame_resize_height, config.frame_resize_width))
+
+
+def merge_tile_rects(rects):
+    """
+    Merge tile-space (c0, r0, c1, r1) rects that overlap or touch.
+    The bounding rect of an L- or U-shaped group can contain or abut another
+    group's rect; processing both would detect the shared pixels twice.
+    Returns list of disjoint rects at least one tile apart
+    """
+    rects = list(rects)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                a, b = rects[i], rects[j]
+                if a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]:
+                    rects[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del rects[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return rects
+
+
+class TileGate:
+    """
+    Tracks which tiles of a fixed-camera frame are worth running full detection on.
+
+    Each frame is reduced to a small grid of sub-tile means; a tile changes when any
+    of its sub-tiles moves by more than `tile_change_threshold`. Tiles that stay
+    quiet for `tile_static_frames` frames become part of the static mask and are
+    skipped until they change again. Active tiles are grown by one tile so motion
+    running into a static neighbour is not cut off. Tiles fully covered by the
+    exclusion mask are never processed.
+    """
+
+    def __init__(self, frame_shape, config: PipelineConfig, excluded=None):
+        self.config = config
+        h, w = frame_shape[:2]
+        # whole-pixel sub-cells keep the downscale on OpenCV's fast integer-factor path
+        check_tile_size(config.tile_size)
+        tile = config.tile_size
+        self.cell = tile // TILE_SUBDIVISIONS
+        self.cells_y = max(1, h // self.cell)
+        self.cells_x = max(1, w // self.cell)
+        self.rows = -(-self.cells_y // TILE_SUBDIVISIONS)
+        self.cols = -(-self.cells_x // TILE_SUBDIVISIONS)
+        # tile edges in pixels; the last row/column of tiles absorbs any remainder
+        self.row_edges = np.minimum(np.arange(self.rows + 1) * tile, h)
+        self.col_edges = np.minimum(np.arange(self.cols + 1) * tile, w)
+        self.row_edges[-1], self.col_edges[-1] = h, w
+        self.prev_small = None
+        self.quiet_frames = np.zeros((self.rows, self.cols), dtype=np.int32)
+
+        self.excluded_tiles = np.zeros((self.rows, self.cols), dtype=bool)
+        if excluded is not None:
+            for r in range(self.rows):
+                for c in range(self.cols):
+                    self.excluded_tiles[r, c] = excluded[
+                        self.row_edges[r]:self.row_edges[r + 1], self.col_edges[c]:self.col_edges[c + 1]
+                    ].all()
+
+        self.pixels_total = 0
+        self.pixels_processed = 0
+
+    def active_regions(self, gray):
+        """
+        Update the static mask with a new grayscale frame.
+        Returns list of (x0, y0, x1, y1) pixel rects, one per connected group of active tiles
+        """
+        covered = gray[:self.cells_y * self.cell, :self.cells_x * self.cell]
+        small = cv2.resize(covered, (self.cells_x, self.cells_y), interpolation=cv2.INTER_AREA).astype(np.int16)
+        prev_small, self.prev_small = self.prev_small, small
+        if prev_small is None:
+            return []
+
+        change = np.abs(small - prev_small)
+        change = np.pad(change, (
+            (0, self.rows * TILE_SUBDIVISIONS - self.cells_y),
+            (0, self.cols * TILE_SUBDIVISIONS - self.cells_x),
+        ))
+        change = change.reshape(self.rows, TILE_SUBDIVISIONS, self.cols, TILE_SUBDIVISIONS).max(axis=(1, 3))
+        changed = change > self.config.tile_change_threshold
+        self.quiet_frames = np.where(changed, 0, self.quiet_frames + 1)
+        active = (self.quiet_frames < self.config.tile_static_frames).astype(np.uint8)
+        # grow by one tile so motion running into a static neighbour is not cut at the region edge
+        active = cv2.dilate(active, np.ones((3, 3), np.uint8)).astype(bool) & ~self.excluded_tiles
+
+        # group neighbouring tiles so objects crossing tile edges give a single box
+        n_labels, _, stats, _ = cv2.connectedComponentsWithStats(active.astype(np.uint8), connectivity=8)
+        rects = [(c, r, c + cw, r + rh) for c, r, cw, rh in stats[1:n_labels, :4]]
+        return [
+            (int(self.col_edges[c0]), int(self.row_edges[r0]), int(self.col_edges[c1]), int(self.row_edges[r1]))
+            for c0, r0, c1, r1 in merge_tile_rects(rects)
+        ]
+
+
 class DetectionProcess(Process):
     """Process that detects motion in frames."""
 
@@ -20,12 +152,113 @@ class DetectionProcess(Process):
         input_queue,  # multiprocessing.Queue
         output_queue,  # multiprocessing.Queue
         config: PipelineConfig,
+        heartbeat: Optional[StageHeartbeat] = None,
     ):
         super().__init__()
         self.input_queue = input_queue
         self.output_queue = output_queue
         self.config = config
+        self.heartbeat = heartbeat if heartbeat is not None else StageHeartbeat()
         self.prev_frame = None
+        self.excluded = None  # boolean mask of ignored pixels
+        self.tile_gate = None
+
+    def extract_boxes(self, dilated, offset_x=0, offset_y=0):
+        """
+        Find contours in a dilated motion mask and return their bounding boxes.
+        Returns list of (x, y, w, h) in frame coordinates
+        """
+        contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        motion_boxes = []
+        for contour in contours:
+            if cv2.contourArea(contour) < self.config.min_motion_area:
+                continue
+            (x,y,w,h)=cv2.boundingRect(contour)
+            motion_boxes.append((x + offset_x,y + offset_y,w,h))
+        return motion_boxes
+
+    def detect_motion_tiled(self, frame_data, current_frame_gray, k):
+        """
+        Detect motion only inside tiles the tile gate reports as active.
+        The previous frame is kept unblurred so both frames can be blurred per region.
+        Returns DetectionData
+        """
+        if self.tile_gate is None:
+            self.tile_gate = TileGate(current_frame_gray.shape, self.config, self.excluded)
+        regions = self.tile_gate.active_regions(current_frame_gray)
+        h, w = current_frame_gray.shape[:2]
+        blur_margin = k // 2
+        dilate_margin = 6  # motion up to 3px outside a region still dilates 3px further
+        motion_boxes = []
+        if self.prev_frame is not None:
+            for (x0, y0, x1, y1) in regions:
+                # dilation region: active tiles plus enough context for dilation
+                dx0, dy0 = max(0, x0 - dilate_margin), max(0, y0 - dilate_margin)
+                dx1, dy1 = min(w, x1 + dilate_margin), min(h, y1 + dilate_margin)
+                # blur region: extra context so the blur is exact inside the dilation region
+                bx0, by0 = max(0, dx0 - blur_margin), max(0, dy0 - blur_margin)
+                bx1, by1 = min(w, dx1 + blur_margin), min(h, dy1 + blur_margin)
+
+                prev_blurred = cv2.GaussianBlur(self.prev_frame[by0:by1, bx0:bx1],(k,k),0)
+                current_blurred = cv2.GaussianBlur(current_frame_gray[by0:by1, bx0:bx1],(k,k),0)
+                diff_gray = cv2.absdiff(prev_blurred,current_blurred)
+                _, thresh = cv2.threshold(diff_gray,self.config.detection_threshold,255,cv2.THRESH_BINARY)
+                thresh = np.ascontiguousarray(thresh[dy0 - by0:dy1 - by0, dx0 - bx0:dx1 - bx0])
+                if self.excluded is not None:
+                    thresh[self.excluded[dy0:dy1, dx0:dx1]] = 0
+                dilated = cv2.dilate(thresh,None,iterations=3)
+                motion_boxes.extend(self.extract_boxes(dilated, dx0, dy0))
+                self.tile_gate.pixels_processed += (bx1 - bx0) * (by1 - by0)
+        self.tile_gate.pixels_total += h * w
+
+        self.prev_frame = current_frame_gray
+        return DetectionData(frame_id=frame_data.frame_id,
+                             frame=frame_data.frame,
+                             motion_boxes=motion_boxes
+                             )
+
+    def detect_motion(self, frame_data, k):
+        """
+        Detect motion in a single frame against the previous one.
+        Returns DetectionData
+        """
+        current_frame = frame_data.frame
+        current_frame_gray = cv2.cvtColor(current_frame,cv2.COLOR_BGR2GRAY)
+        if self.excluded is None and self.config.exclusion_mask:
+            self.excluded = load_exclusion_mask(self.config.exclusion_mask, current_frame.shape)
+        if self.config.tile_gating:
+            return self.detect_motion_tiled(frame_data, current_frame_gray, k)
+
+        current_frame_gray_blurred = cv2.GaussianBlur(current_frame_gray,(k,k),0)
+        motion_boxes = []
+        if self.prev_frame is not None:
+            
+            # calculate absolute differecne with previous frame
+            diff_gray = cv2.absdiff(self.prev_frame,current_frame_gray_blurred)
+            
+            # apply threshold
+            _, thresh = cv2.threshold(diff_gray,self.config.detection_threshold,255,cv2.THRESH_BINARY)
+            if self.excluded is not None:
+                thresh[self.excluded] = 0
+            
+            # dilate thresh to fill in holes
+            dilated = cv2.dilate(thresh,None,iterations=3)
+            
+            # find contours and extract bounding box
+            motion_boxes = self.extract_boxes(dilated)
+        
+        self.prev_frame = current_frame_gray_blurred
+        return DetectionData(frame_id=frame_data.frame_id,
+                             frame=frame_data.frame,
+                             motion_boxes=motion_boxes
+                             )
+
+    def detect_batch(self, batch, k):
+        """
+        Detect motion in a batch of frames, in order, carrying the previous frame across.
+        Returns list of DetectionData
+        """
+        return [self.detect_motion(frame_data, k) for frame_data in batch]
 
     def run(self):
         """
@@ -33,75 +266,45 @@ class DetectionProcess(Process):
         
         """
         print("DetectionProcess: Starting motion detection")
-        prev_frame_gray_blurred = None
+        self.heartbeat.beat()
         
         k = int(self.config.gaussian_blur_size)
         if k % 2 == 0:
             k += 1
         if k < 3:
             k = 3
+        sender = BatchSender(self.output_queue, self.config, "DetectionProcess")
         try:
             while True:
                 try:
-                    frame_data = self.input_queue.get(timeout=self.config.queue_timeout)
+                    batch = self.input_queue.get(timeout=receive_timeout(self.config, sender))
                 except Empty:
+                    sender.flush_if_due()
                     continue
-                if frame_data is None:  # End of stream
-                    while True:
-                        try:
-                            self.output_queue.put(None,timeout=self.config.queue_timeout)
-                            break
-                        except Full:
-                            print("DetectionProcess: output queue full while sending sentinel, waiting...")
+                if batch is None:  # End of stream
+                    sender.close()
+                    if self.tile_gate is not None and self.tile_gate.pixels_total:
+                        fraction = self.tile_gate.pixels_processed / self.tile_gate.pixels_total
+                        print(f"DetectionProcess: tile gating processed {fraction:.1%} of pixels")
                     print("DetectionProcess: Finished (received sentinel)")
                     return
                 # Detect motion and queue results
-                current_frame = frame_data.frame
-                current_frame_gray = cv2.cvtColor(current_frame,cv2.COLOR_BGR2GRAY)
-                current_frame_gray_blurred = cv2.GaussianBlur(current_frame_gray,(k,k),0)
-                if prev_frame_gray_blurred is None:
-                    detection_data = DetectionData(frame_id=frame_data.frame_id,
-                                               frame=frame_data.frame,
-                                               motion_boxes=[]
-                                               )
-                else:
-                    
-                    # calculate absolute differecne with previous frame
-                    diff_gray = cv2.absdiff(prev_frame_gray_blurred,current_frame_gray_blurred)
-                    
-                    # apply threshold
-                    _, thresh = cv2.threshold(diff_gray,self.config.detection_threshold,255,cv2.THRESH_BINARY)
-                    
-                    # dilate thresh to fill in holes
-                    dilated = cv2.dilate(thresh,None,iterations=3)
-                    
-                    # find contours and extract bounding box
-                    contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                    motion_boxes = []
-                    for contour in contours:
-                        if cv2.contourArea(contour) < self.config.min_motion_area:
-                            continue
-                        (x,y,w,h)=cv2.boundingRect(contour)
-                        motion_boxes.append((x,y,w,h))
-                    
-                    detection_data = DetectionData(frame_id=frame_data.frame_id,
-                                               frame=frame_data.frame,
-                                               motion_boxes=motion_boxes
-                                               )
-                    
-                while True:
-                    try:
-                        self.output_queue.put(detection_data,timeout=self.config.queue_timeout)
-                        break
-                    except Full:
-                        print("DetectionProcess: output queue full, waiting....")
-                prev_frame_gray_blurred = current_frame_gray_blurred
+                for detection_data in self.detect_batch(batch, k):
+                    sender.put(detection_data)
+                self.heartbeat.beat(len(batch))
                 
         except Exception as e:
             print(f"DetectionProcess: error:{e}")
+            # pass on frames already processed so only the failing batch is lost
             try:
-                self.output_queue.put(None, timeout=self.config.queue_timeout)
+                sender.flush()
             except Exception:
                 pass
+            # When the supervisor may restart this stage, keep downstream alive
+            # instead of ending the stream.
+            if not self.config.supervisor_restart_crashed:
+                try:
+                    self.output_queue.put(None, timeout=self.config.queue_timeout)
+                except Exception:
+                    pass
             raise
-            
\ No newline at end of file
@@ -7,9 +7,8 @@ import cv2
 import time
 from multiprocessing import Process
 from typing import Optional
-from queue import Full
 
-from pipeline.queue_manager import FrameData
+from pipeline.queue_manager import FrameData, StageHeartbeat, BatchSender
 from config import PipelineConfig
 
 
@@ -22,11 +21,13 @@ class FrameReaderProcess(Process):
         input_video: str,
         output_queue,  # multiprocessing.Queue
         config: PipelineConfig,
+        heartbeat: Optional[StageHeartbeat] = None,
     ):
         super().__init__()
         self.input_video = input_video
         self.output_queue = output_queue
         self.config = config
+        self.heartbeat = heartbeat if heartbeat is not None else StageHeartbeat()
 
     def run(self):
         """
@@ -34,6 +35,7 @@ class FrameReaderProcess(Process):
         
         """
         print(f"FrameReaderProcess: Starting to read {self.input_video}")
+        self.heartbeat.beat()
 
         cap = cv2.VideoCapture(self.input_video)
         
@@ -44,6 +46,7 @@ class FrameReaderProcess(Process):
             except Exception:
                 pass
             return 
+        sender = BatchSender(self.output_queue, self.config, "FrameReader")
         try:
             original_fps = cap.get(cv2.CAP_PROP_FPS)
             if not original_fps or original_fps <=0:
@@ -62,17 +65,16 @@ class FrameReaderProcess(Process):
                                     dsize=(self.config.frame_resize_width,self.config.frame_resize_height),
                                     interpolation=cv2.INTER_AREA)
                     frame_data = FrameData(frame_id=frame_id,frame = frame, timestamp=frame_id/original_fps)
-                    while True:
-                        try:
-                            self.output_queue.put(frame_data,timeout=self.config.queue_timeout)
-                            break
-                        except Full:
-                            print("FrameReader: output queue full, waiting....")
+                    sender.put(frame_data)
+                    self.heartbeat.beat(1)
+                else:
+                    # skipped frames still advance the clock on a pending partial batch
+                    sender.flush_if_due()
                 frame_id += 1
         finally:
             cap.release()
             try:
-                self.output_queue.put(None,timeout=self.config.queue_timeout)
+                sender.close()
             except Exception:
                 pass
 
@@ -7,9 +7,10 @@ import os
 import cv2
 import numpy as np
 from multiprocessing import Process
+from typing import Optional
 from queue import Empty
 
-from pipeline.queue_manager import ViewportData
+from pipeline.queue_manager import ViewportData, StageHeartbeat
 from config import PipelineConfig
 
 
@@ -21,11 +22,46 @@ class OutputWriterProcess(Process):
         input_queue,  # multiprocessing.Queue
         output_dir: str,
         config: PipelineConfig,
+        heartbeat: Optional[StageHeartbeat] = None,
     ):
         super().__init__()
         self.input_queue = input_queue
         self.output_dir = output_dir
         self.config = config
+        self.heartbeat = heartbeat if heartbeat is not None else StageHeartbeat()
+
+    def write_frame(self, viewport_data, frames_dir, viewport_dir, video_writer, viewport_writer):
+        """
+        Draw, save and encode a single frame.
+
+        """
+        frame_id,frame,viewport_center,viewport_size = viewport_data.frame_id,viewport_data.frame,viewport_data.viewport_center,viewport_data.viewport_size
+
+        # Draw viewport rectangle
+        x,y = viewport_center
+        vp_width, vp_height = viewport_size 
+        x1,y1,x2,y2 = int(x-vp_width/2),int(y-vp_height/2), int(x + vp_width/2), int(y + vp_height/2)
+
+        frame_copy =frame.copy()
+        motion_boxes=viewport_data.motion_boxes
+        for box in motion_boxes:
+            cv2.rectangle(frame_copy,(box[0],box[1]),(box[0]+box[2],box[1]+box[3]),(0,255,0),1)
+        cv2.putText(img=frame_copy,text=f"Frame: {frame_id+1}", org=(10, 30),fontFace=cv2.FONT_HERSHEY_SIMPLEX,fontScale=0.8,color=(0, 255, 0),thickness=2,lineType=cv2.LINE_AA)
+        cv2.rectangle(frame_copy,(x1,y1),(x2,y2),(255,0,0),2)
+
+        # extract viewport content 
+        vp_frame = frame[y1:y2,x1:x2].copy()
+        cv2.putText(img=vp_frame,text=f"Frame: {frame_id}", org=(10, 30),fontFace=cv2.FONT_HERSHEY_SIMPLEX,fontScale=0.8,color=(0, 255, 0),thickness=2,lineType=cv2.LINE_AA)
+
+        # saving images
+        filename = os.path.join(frames_dir, f"frame_{frame_id+1:04d}.png")
+        cv2.imwrite(filename,frame_copy)
+        filename = os.path.join(viewport_dir, f"frame_{frame_id+1:04d}.png")
+        cv2.imwrite(filename,vp_frame)
+
+        # writing frames to video writers
+        video_writer.write(frame_copy)
+        viewport_writer.write(vp_frame)
 
     def run(self):
         """
@@ -33,6 +69,7 @@ class OutputWriterProcess(Process):
 
         """
         print("OutputWriterProcess: Starting output writing")
+        self.heartbeat.beat()
 
         # Create output directories
         frames_dir = os.path.join(self.output_dir, "frames")
@@ -55,40 +92,15 @@ class OutputWriterProcess(Process):
         try:
             while True:
                 try:
-                    viewport_data = self.input_queue.get(timeout=self.config.queue_timeout)
+                    batch = self.input_queue.get(timeout=self.config.queue_timeout)
                 except Empty:
                     continue   
-                if viewport_data is None:
+                if batch is None:
                     print("VideoWriter: Finished (received sentinel)")
                     return
-                frame_id,frame,viewport_center,viewport_size = viewport_data.frame_id,viewport_data.frame,viewport_data.viewport_center,viewport_data.viewport_size
-                
-                # Draw viewport rectangle
-                x,y = viewport_center
-                vp_width, vp_height = viewport_size 
-                x1,y1,x2,y2 = int(x-vp_width/2),int(y-vp_height/2), int(x + vp_width/2), int(y + vp_height/2)
-                
-                frame_copy =frame.copy()
-                motion_boxes=viewport_data.motion_boxes
-                for box in motion_boxes:
-                    cv2.rectangle(frame_copy,(box[0],box[1]),(box[0]+box[2],box[1]+box[3]),(0,255,0),1)
-                cv2.putText(img=frame_copy,text=f"Frame: {frame_id+1}", org=(10, 30),fontFace=cv2.FONT_HERSHEY_SIMPLEX,fontScale=0.8,color=(0, 255, 0),thickness=2,lineType=cv2.LINE_AA)
-                cv2.rectangle(frame_copy,(x1,y1),(x2,y2),(255,0,0),2)
-                
-                
-                # extract viewport content 
-                vp_frame = frame[y1:y2,x1:x2].copy()
-                cv2.putText(img=vp_frame,text=f"Frame: {frame_id}", org=(10, 30),fontFace=cv2.FONT_HERSHEY_SIMPLEX,fontScale=0.8,color=(0, 255, 0),thickness=2,lineType=cv2.LINE_AA)
-                
-                # saving images
-                filename = os.path.join(frames_dir, f"frame_{frame_id+1:04d}.png")
-                cv2.imwrite(filename,frame_copy)
-                filename = os.path.join(viewport_dir, f"frame_{frame_id+1:04d}.png")
-                cv2.imwrite(filename,vp_frame)
-                
-                # writing frames to video writers
-                video_writer.write(frame_copy)
-                viewport_writer.write(vp_frame)
+                for viewport_data in batch:
+                    self.write_frame(viewport_data, frames_dir, viewport_dir, video_writer, viewport_writer)
+                self.heartbeat.beat(len(batch))
                 
         except Exception as e:
             print(f"Video Writer Error:{e}")
@@ -4,8 +4,10 @@ Queue management for inter-process communication.
 """
 
 import multiprocessing
-from dataclasses import dataclass
-from typing import Any
+import time
+from dataclasses import dataclass, field
+from queue import Full
+from typing import Any, Optional
 
 from config import PipelineConfig
 
@@ -39,6 +41,85 @@ class ViewportData:
     motion_boxes: list # List of (x,y,w,h) bounding boxes
 
 
+@dataclass
+class StageHeartbeat:
+    """Shared progress counters a stage updates and the supervisor reads."""
+
+    last_beat: Any = field(default_factory=lambda: multiprocessing.Value("d", 0.0, lock=False))
+    items_processed: Any = field(default_factory=lambda: multiprocessing.Value("q", 0, lock=False))
+
+    def beat(self, items: int = 0):
+        """Record progress. Only the owning stage writes, so no lock is needed."""
+        self.last_beat.value = time.time()
+        self.items_processed.value += items
+
+
+class BatchSender:
+    """
+    Groups items into lists before putting them on a queue.
+
+    A batch is sent once it holds `batch_size` items or once its first item has
+    waited `batch_max_wait` seconds, whichever comes first. The end-of-stream
+    sentinel (`None`) is always sent on its own.
+    """
+
+    def __init__(self, queue, config: PipelineConfig, name: str):
+        self.queue = queue
+        self.config = config
+        self.name = name
+        self.batch_size = max(1, config.batch_size)
+        self.batch = []
+        self.deadline = None
+
+    def put(self, item):
+        """Add an item, sending the batch if it is full or overdue."""
+        if not self.batch:
+            self.deadline = time.monotonic() + self.config.batch_max_wait
+        self.batch.append(item)
+        if len(self.batch) >= self.batch_size or time.monotonic() >= self.deadline:
+            self.flush()
+
+    def time_until_due(self) -> Optional[float]:
+        """Seconds until the pending batch must be sent, or None if nothing is pending."""
+        if not self.batch:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def flush_if_due(self):
+        """Send the pending batch if its max-wait deadline has passed."""
+        if self.batch and time.monotonic() >= self.deadline:
+            self.flush()
+
+    def flush(self):
+        """Send the pending batch, blocking while the queue is full."""
+        if not self.batch:
+            return
+        self._put_blocking(self.batch)
+        self.batch = []
+        self.deadline = None
+
+    def close(self):
+        """Send any pending items followed by the end-of-stream sentinel."""
+        self.flush()
+        self._put_blocking(None)
+
+    def _put_blocking(self, item):
+        while True:
+            try:
+                self.queue.put(item, timeout=self.config.queue_timeout)
+                return
+            except Full:
+                print(f"{self.name}: output queue full, waiting....")
+
+
+def receive_timeout(config: PipelineConfig, sender: Optional[BatchSender] = None) -> float:
+    """Queue get timeout that still lets a pending outgoing batch go out on time."""
+    due = sender.time_until_due() if sender is not None else None
+    if due is None:
+        return config.queue_timeout
+    return min(config.queue_timeout, max(due, 0.001))
+
+
 class QueueManager:
     """Manages all queues for the pipeline."""
 
@@ -48,7 +129,9 @@ class QueueManager:
         
         """
         self.config = config
+        # Queues carry batches, so size them to keep roughly queue_max_size items in flight
+        maxsize = max(1, config.queue_max_size // max(1, config.batch_size))
         # Initialize queues
-        self.raw_frames_queue = multiprocessing.Queue(maxsize=config.queue_max_size)
-        self.detections_queue = multiprocessing.Queue(maxsize=config.queue_max_size)
-        self.viewport_queue = multiprocessing.Queue(maxsize=config.queue_max_size)
\ No newline at end of file
+        self.raw_frames_queue = multiprocessing.Queue(maxsize=maxsize)
+        self.detections_queue = multiprocessing.Queue(maxsize=maxsize)
+        self.viewport_queue = multiprocessing.Queue(maxsize=maxsize)
@@ -5,16 +5,26 @@ Viewport calculation process with state machine and smoothing.
 
 import numpy as np
 import math
+import time
+import tempfile
 import random
 from multiprocessing import Process
+from typing import Optional
 from collections import deque
 from enum import Enum
-from queue import Empty, Full
+from queue import Empty
 
-from pipeline.queue_manager import DetectionData, ViewportData
+from pipeline.queue_manager import DetectionData, ViewportData, StageHeartbeat, BatchSender, receive_timeout
 from config import PipelineConfig
 
 
+# ROI scoring hyperparams (tune or move to config)
+AREA_CAP_FRAC = 0.08        # cap area to 8% of frame
+BOTTOM_IGNORE_FRAC = 0.30   # penalize bottom 25% (fisheye/ref/bench zone)
+LAMBDA_DIST = 0.6           # distance penalty weight
+GAMMA_BOTTOM = 2.5         # bottom penalty weight
+
+
 class ViewportState(Enum):
     """Viewport calculation states."""
 
@@ -30,20 +40,63 @@ class ViewportCalculatorProcess(Process):
         input_queue,  # multiprocessing.Queue
         output_queue,  # multiprocessing.Queue
         config: PipelineConfig,
+        heartbeat: Optional[StageHeartbeat] = None,
     ):
         super().__init__()
         self.input_queue = input_queue
         self.output_queue = output_queue
         self.config = config
+        self.heartbeat = heartbeat if heartbeat is not None else StageHeartbeat()
         self.state = ViewportState.STEADY
         self.current_viewport_center = None
         self.smoothing_buffer = deque(maxlen=config.smoothing_window_size)
         self.no_motion_count = 0
         self.steady_after_n = 3
 
-    def calculate_roi(self, motion_boxes, frame_shape):
+    def score_box_batch(self, box_sets, frame_shape):
+        """
+        Score the previous-center-independent terms for a batch of box sets at once.
+        All boxes in the batch are stacked into one array so the area and bottom
+        penalty terms are computed in a single vectorised pass.
+        Returns list of (centers, area_terms, bottom_penalties) arrays, one per box set
+        """
+        h, w = frame_shape[:2]
+        counts = [len(boxes) for boxes in box_sets]
+        if sum(counts) == 0:
+            return [None] * len(box_sets)
+
+        boxes = np.array([box for boxes in box_sets for box in boxes], dtype=np.float64).reshape(-1, 4)
+        frame_area = w * h
+        area_cap = AREA_CAP_FRAC * frame_area
+
+        # cap huge blobs
+        areas = np.minimum(boxes[:, 2] * boxes[:, 3], area_cap)
+        centers = boxes[:, :2] + boxes[:, 2:] / 2.0
+
+        # bottom penalty: boxes whose center is near bottom get penalized
+        # (fisheye makes near-camera blobs huge)
+        bottom_zone_start = (1.0 - BOTTOM_IGNORE_FRAC) * h
+        bottom_pen = np.where(
+            centers[:, 1] > bottom_zone_start,
+            (centers[:, 1] - bottom_zone_start) / (h * BOTTOM_IGNORE_FRAC + 1e-9),  # 0..1
+            0.0,
+        )
+
+        scored = []
+        start = 0
+        for count in counts:
+            end = start + count
+            if count == 0:
+                scored.append(None)
+            else:
+                scored.append((centers[start:end], areas[start:end] / frame_area, bottom_pen[start:end]))
+            start = end
+        return scored
+
+    def calculate_roi(self, motion_boxes, frame_shape, scored=None):
         """
         Calculate region of interest from motion boxes.
+        `scored` is this frame's entry from score_box_batch, computed here if not given.
         Returns (x, y) center coordinates
         """
         """if not motion_boxes:
@@ -59,47 +112,23 @@ class ViewportCalculatorProcess(Process):
         if not motion_boxes:
             return prev_center if prev_center is not None else (w // 2, h // 2)
 
-        # hyperparams (tune or move to config)
-        AREA_CAP_FRAC = 0.08        # cap area to 8% of frame
-        BOTTOM_IGNORE_FRAC = 0.30   # penalize bottom 25% (fisheye/ref/bench zone)
-        LAMBDA_DIST = 0.6           # distance penalty weight
-        GAMMA_BOTTOM = 2.5         # bottom penalty weight
+        if scored is None:
+            scored = self.score_box_batch([motion_boxes], frame_shape)[0]
+        centers, area_terms, bottom_pen = scored
 
-        frame_area = w * h
-        area_cap = AREA_CAP_FRAC * frame_area
         diag = math.hypot(w, h)
 
         if prev_center is None:
             prev_center = (w // 2, h // 2)
 
-        best_score = -1e18
-        best_center = prev_center
-
-        for (x, y, bw, bh) in motion_boxes:
-            area = bw * bh
-            area = min(area, area_cap)  # cap huge blobs
-
-            cx = x + bw / 2.0
-            cy = y + bh / 2.0
-
-            # distance to previous center (normalized)
-            dist = math.hypot(cx - prev_center[0], cy - prev_center[1]) / (diag + 1e-9)
-
-            # bottom penalty: boxes whose center is near bottom get penalized
-            # (fisheye makes near-camera blobs huge)
-            bottom_zone_start = (1.0 - BOTTOM_IGNORE_FRAC) * h
-            bottom_pen = 0.0
-            if cy > bottom_zone_start:
-                bottom_pen = (cy - bottom_zone_start) / (h * BOTTOM_IGNORE_FRAC + 1e-9)  # 0..1
+        # distance to previous center (normalized)
+        dist = np.hypot(centers[:, 0] - prev_center[0], centers[:, 1] - prev_center[1]) / (diag + 1e-9)
 
-            # score: prefer area, prefer continuity, avoid bottom
-            score = (area / frame_area) - (LAMBDA_DIST * dist) - (GAMMA_BOTTOM * bottom_pen)
+        # score: prefer area, prefer continuity, avoid bottom
+        scores = area_terms - (LAMBDA_DIST * dist) - (GAMMA_BOTTOM * bottom_pen)
 
-            if score > best_score:
-                best_score = score
-                best_center = (int(cx), int(cy))
-
-        return best_center
+        cx, cy = centers[int(np.argmax(scores))]
+        return (int(cx), int(cy))
 
     def update_state(self, motion_boxes):
         """
@@ -146,65 +175,270 @@ class ViewportCalculatorProcess(Process):
 
         return (x, y)
 
+    def process_detection(self, detection_data, scored=None):
+        """
+        Advance the state machine by one frame.
+        Returns ViewportData
+        """
+        frame_shape = detection_data.frame.shape
+        viewport_size = (self.config.viewport_width, self.config.viewport_height)
+        if self.current_viewport_center is None:
+            h, w = frame_shape[:2]
+            self.current_viewport_center = (w // 2, h // 2)
+            
+        self.update_state(detection_data.motion_boxes)
+        if self.state == ViewportState.STEADY:
+            self.smoothing_buffer.clear()
+        
+        if self.state == ViewportState.TRACKING:
+            raw_centre = self.calculate_roi(detection_data.motion_boxes,frame_shape,scored)
+            clamped_centre = self.clamp_viewport(raw_centre,frame_shape)
+            smoothed_centre = self.smooth_viewport(clamped_centre)
+            clamped_centre = self.clamp_viewport(smoothed_centre,frame_shape)
+            self.current_viewport_center = clamped_centre
+        
+        viewport_centre = self.current_viewport_center
+        
+        return ViewportData(frame_id=detection_data.frame_id,
+                            frame=detection_data.frame,
+                            viewport_center=viewport_centre,
+                            viewport_size=viewport_size,
+                            motion_boxes=detection_data.motion_boxes)
+
     def run(self):
         """
         Calculate viewport positions from detection data.
 
         """
         print("ViewportCalculatorProcess: Starting viewport calculation")
+        self.heartbeat.beat()
 
         # Initialize viewport to center
         # TODO: Get first frame to initialize viewport center
+        sender = BatchSender(self.output_queue, self.config, "ViewportCalculatorProcess")
         try:
             while True:
                 try:
-                    detection_data = self.input_queue.get(timeout=self.config.queue_timeout)
+                    batch = self.input_queue.get(timeout=receive_timeout(self.config, sender))
                 except Empty:
+                    sender.flush_if_due()
                     continue
-                if detection_data is None:
-                    while True:
-                        try:
-                            self.output_queue.put(None,timeout=self.config.queue_timeout)
-                            break
-                        except Full:
-                            print("ViewportCalculatorProcess: output queue full while sending sentinel, waiting...")
+                if batch is None:
+                    sender.close()
                     print("ViewportCalculatorProcess: Finished (received sentinel)")        
                     return
-                frame_shape = detection_data.frame.shape
-                viewport_size = (self.config.viewport_width, self.config.viewport_height)
-                if self.current_viewport_center is None:
-                    h, w = frame_shape[:2]
-                    self.current_viewport_center = (w // 2, h // 2)
-                    
-                self.update_state(detection_data.motion_boxes)
-                if self.state == ViewportState.STEADY:
-                    self.smoothing_buffer.clear()
-                
-                if self.state == ViewportState.TRACKING:
-                    raw_centre = self.calculate_roi(detection_data.motion_boxes,frame_shape)
-                    clamped_centre = self.clamp_viewport(raw_centre,frame_shape)
-                    smoothed_centre = self.smooth_viewport(clamped_centre)
-                    clamped_centre = self.clamp_viewport(smoothed_centre,frame_shape)
-                    self.current_viewport_center = clamped_centre
-                
-                viewport_centre = self.current_viewport_center
-                
-                viewport_data = ViewportData(frame_id=detection_data.frame_id,
-                                             frame=detection_data.frame,
-                                             viewport_center=viewport_centre,
-                                             viewport_size=viewport_size,
-                                             motion_boxes=detection_data.motion_boxes)
-                while True:
-                    try:
-                        self.output_queue.put(viewport_data,timeout=self.config.queue_timeout)
-                        break
-                    except Full:
-                        print("ViewportCalculatorProcess:outputqueue full, waiting...")
+                # frames in a batch share the reader's resize dimensions
+                scored_batch = self.score_box_batch([d.motion_boxes for d in batch], batch[0].frame.shape)
+                for detection_data, scored in zip(batch, scored_batch):
+                    sender.put(self.process_detection(detection_data, scored))
+                self.heartbeat.beat(len(batch))
         
         except Exception as e:
             print(f"ViewportCalculator error: {e}")
+            # pass on frames already processed so only the failing batch is lost
+            try:
+                sender.flush()
+            except Exception:
+                pass
             try:
                 self.output_queue.put(None,timeout=self.config.queue_timeout)
             except Exception:
                 pass    
-            raise
\ No newline at end of file
+            raise
+
+
+def _gaussian_smooth(path, sigma):
+    """Zero-phase gaussian smoothing of an (N, 2) path, edges padded with the end values."""
+    if sigma <= 0 or len(path) < 2:
+        return path
+    radius = max(1, int(3 * sigma + 0.5))
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-(offsets ** 2) / (2 * sigma ** 2))
+    kernel /= kernel.sum()
+    padded = np.pad(path, ((radius, radius), (0, 0)), mode="edge")
+    return np.stack(
+        [np.convolve(padded[:, axis], kernel, mode="valid") for axis in range(path.shape[1])],
+        axis=1,
+    )
+
+
+def _rate_limit(target, max_velocity, max_acceleration):
+    """
+    Follow a 1-D target with bounded speed and acceleration.
+    Braking from speed s loses max_acceleration per frame and covers at most
+    s * (s + a) / (2 * a) + a / 4, so the speed command is capped to what still
+    stops within the remaining distance; residuals under one frame's acceleration
+    are closed directly. A final clamp keeps rounding or a moving target from
+    carrying the camera past the target.
+    """
+    values = target.tolist()  # python floats are much faster to loop over than numpy scalars
+    a = max_acceleration
+    pos = values[0]
+    vel = 0.0
+    out = [pos]
+    for value in values[1:]:
+        error = value - pos
+        distance = max(0.0, abs(error) - a / 4.0)
+        braking_speed = a * (math.sqrt(0.25 + 2.0 * distance / a) - 0.5)
+        # a residual within one frame's acceleration can be closed and stopped on directly
+        braking_speed = max(braking_speed, min(abs(error), a))
+        desired = math.copysign(min(max_velocity, abs(error), braking_speed), error)
+        vel += max(-a, min(a, desired - vel))
+        if (value - (pos + vel)) * error < 0:
+            # would pass the target: stop on it instead
+            vel = error
+        pos += vel
+        out.append(pos)
+    return np.array(out)
+
+
+def solve_viewport_path(raw_centers, frame_shape, config: PipelineConfig):
+    """
+    Compute the viewport path over a whole sequence.
+    `raw_centers` is an (N, 2) array of per-frame target centers.
+    Returns an (N, 2) int array of clamped viewport centers
+    """
+    path = np.asarray(raw_centers, dtype=np.float64).reshape(-1, 2)
+    if len(path) == 0:
+        return path.astype(int)
+
+    h, w = frame_shape[:2]
+    vp_w, vp_h = config.viewport_width, config.viewport_height
+    low = np.array([vp_w // 2, vp_h // 2])
+    high = np.array([w - vp_w // 2, h - vp_h // 2])
+
+    path = _gaussian_smooth(np.clip(path, low, high), config.offline_smoothing_sigma)
+
+    # look-ahead: start moving before the action by shifting the path earlier
+    lead = min(max(0, config.offline_lookahead), len(path) - 1)
+    if lead:
+        path = np.concatenate([path[lead:], np.repeat(path[-1:], lead, axis=0)])
+
+    # Speed/acceleration limits are the only recursive step. Averaging a forward
+    # and a backward pass keeps the result zero-phase, and since the limits are
+    # convex the average still satisfies them.
+    if config.offline_max_velocity > 0 and config.offline_max_acceleration > 0:
+        for axis in range(2):
+            forward = _rate_limit(path[:, axis], config.offline_max_velocity, config.offline_max_acceleration)
+            backward = _rate_limit(path[::-1, axis], config.offline_max_velocity, config.offline_max_acceleration)[::-1]
+            path[:, axis] = (forward + backward) / 2.0
+
+    return np.rint(np.clip(path, low, high)).astype(int)
+
+
+class FrameSpool:
+    """
+    Append-only store of equally shaped frames in an anonymous temporary file
+    (honours TMPDIR), read back in insertion order.
+    """
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.shape = None
+        self.dtype = None
+        self.count = 0
+
+    def append(self, frame):
+        if self.shape is None:
+            self.shape, self.dtype = frame.shape, frame.dtype
+        elif frame.shape != self.shape or frame.dtype != self.dtype:
+            raise ValueError(f"FrameSpool expects {self.shape} {self.dtype} frames, got {frame.shape} {frame.dtype}")
+        self.file.write(np.ascontiguousarray(frame).tobytes())
+        self.count += 1
+
+    def frames(self):
+        """Yield the stored frames in order."""
+        self.file.seek(0)
+        for _ in range(self.count):
+            frame = np.empty(self.shape, dtype=self.dtype)
+            self.file.readinto(frame)
+            yield frame
+
+    def close(self):
+        self.file.close()
+
+
+class OfflineViewportCalculatorProcess(ViewportCalculatorProcess):
+    """
+    Process that collects every detection before solving the viewport path in one go.
+    Looks ahead and smooths without lag, so it is only suitable for file-based jobs.
+    Only frame ids and motion boxes stay in memory; frames are spooled to a
+    temporary file until the path is solved.
+    """
+
+    def raw_targets(self, detections, frame_shape):
+        """
+        Per-frame target centers from the state machine, without causal smoothing.
+        Returns (N, 2) array
+        """
+        if not detections:
+            return np.empty((0, 2))
+        h, w = frame_shape[:2]
+        self.current_viewport_center = (w // 2, h // 2)
+        scored_all = self.score_box_batch([d.motion_boxes for d in detections], frame_shape)
+        targets = np.empty((len(detections), 2))
+        for i, (detection_data, scored) in enumerate(zip(detections, scored_all)):
+            self.update_state(detection_data.motion_boxes)
+            if self.state == ViewportState.TRACKING:
+                raw_centre = self.calculate_roi(detection_data.motion_boxes, frame_shape, scored)
+                self.current_viewport_center = self.clamp_viewport(raw_centre, frame_shape)
+            targets[i] = self.current_viewport_center
+        return targets
+
+    def run(self):
+        """
+        Collect all detections, solve the viewport path and emit it in order.
+
+        """
+        print("OfflineViewportCalculatorProcess: Collecting detections")
+        self.heartbeat.beat()
+        detections = []  # DetectionData without frames
+        spool = FrameSpool()
+        sender = BatchSender(self.output_queue, self.config, "OfflineViewportCalculatorProcess")
+        try:
+            while True:
+                try:
+                    batch = self.input_queue.get(timeout=self.config.queue_timeout)
+                except Empty:
+                    continue
+                if batch is None:
+                    break
+                for detection_data in batch:
+                    spool.append(detection_data.frame)
+                    detections.append(DetectionData(frame_id=detection_data.frame_id,
+                                                    frame=None,
+                                                    motion_boxes=detection_data.motion_boxes))
+                self.heartbeat.beat(len(batch))
+
+            start = time.perf_counter()
+            targets = self.raw_targets(detections, spool.shape)
+            path = solve_viewport_path(targets, spool.shape, self.config)
+            print(
+                f"OfflineViewportCalculatorProcess: solved {len(detections)} frames "
+                f"in {(time.perf_counter() - start) * 1000:.1f} ms"
+            )
+
+            viewport_size = (self.config.viewport_width, self.config.viewport_height)
+            for detection_data, frame, (x, y) in zip(detections, spool.frames(), path):
+                sender.put(ViewportData(frame_id=detection_data.frame_id,
+                                        frame=frame,
+                                        viewport_center=(int(x), int(y)),
+                                        viewport_size=viewport_size,
+                                        motion_boxes=detection_data.motion_boxes))
+                self.heartbeat.beat(1)
+            sender.close()
+            print("OfflineViewportCalculatorProcess: Finished (received sentinel)")
+
+        except Exception as e:
+            print(f"OfflineViewportCalculator error: {e}")
+            try:
+                sender.flush()
+            except Exception:
+                pass
+            try:
+                self.output_queue.put(None,timeout=self.config.queue_timeout)
+            except Exception:
+                pass
+            raise
+        finally:
+            spool.close()